@@ -1,30 +1,162 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, request
 import os
 import json
 import csv
-from collections import defaultdict
+import functools
+import gzip
+import hashlib
+import heapq
+import tempfile
+import threading
+import time
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from parser import parse_workouts_to_csv, aggregate_from_csv, format_aggregated_data
+from operator import itemgetter
+
+try:
+    import orjson
+except ImportError:
+    # Fallback to the stdlib json module if orjson isn't installed
+    orjson = None
 
 try:
     from config import DATA_DIR
 except ImportError:
     # Fallback if config.py doesn't exist
-    DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+    DATA_DIR = os.path.normpath(os.path.dirname(__file__) or '.')
 
 app = Flask(__name__)
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.normpath(os.path.dirname(__file__) or '.')
 EXPORT_FILE = os.path.join(DATA_DIR, 'export.xml')
 PROCESSED_DIR = os.path.join(DATA_DIR, 'processed_data')
+TOTAL_CACHE_DIR = os.path.join(PROCESSED_DIR, '_total')
+TOTAL_CACHE_FILE = os.path.join(TOTAL_CACHE_DIR, 'aggregated.json')
+
+# Month names in calendar order; index with dt.month - 1 instead of strftime('%B')
+MONTH_ORDER = ('January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December')
+
+# Activity name fragments that categorize_activity() treats as Strength Training
+STRENGTH_KEYWORDS = frozenset({'strength', 'core', 'bodyweight', 'yoga', 'mindandbody', 'resistance'})
+
+# Directories under PROCESSED_DIR that don't hold workout activities
+SPECIAL_DIRS = {'sleep', 'steps', 'heart_rate', '_total'}
+
+# Shared pool for fanning out per-activity CSV reads
+READ_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+# Bounded LRUs of response bodies, shared by all request threads
+# RESPONSE_CACHE: serialized /api/* payloads, (full path, input file state, day) -> bytes
+# GZIP_CACHE: gzipped response bodies, ETag -> bytes
+RESPONSE_CACHE = OrderedDict()
+GZIP_CACHE = OrderedDict()
+CACHE_SIZE = 128
+CACHE_LOCK = threading.Lock()
+
+# Responses smaller than this aren't worth compressing
+GZIP_MIN_SIZE = 1024
+
+def cache_get(cache, key):
+    with CACHE_LOCK:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+def cache_put(cache, key, value):
+    with CACHE_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+
+def dump_json(obj):
+    """Encode obj as compact JSON bytes, using orjson when available"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def raw_json_response(payload):
+    """
+    Respond with already-encoded JSON bytes, gzipped when the client accepts it,
+    and tagged with an ETag so a matching If-None-Match gets an empty 304.
+    
+    Bodies are sent whole rather than streamed: the ETag, the gzip cache and
+    RESPONSE_CACHE all need the complete payload, which is already in memory.
+    """
+    etag = hashlib.blake2b(payload, digest_size=8).hexdigest()
+    
+    if len(payload) >= GZIP_MIN_SIZE and request.accept_encodings['gzip']:
+        etag += '-gz'
+        body = cache_get(GZIP_CACHE, etag)
+        if body is None:
+            body = gzip.compress(payload, compresslevel=5, mtime=0)
+            cache_put(GZIP_CACHE, etag, body)
+        response = app.response_class(body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(payload, mimetype='application/json')
+    
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def find_aggregate(name):
+    """
+    Path of the pre-aggregated JSON under PROCESSED_DIR/name, preferring the
+    gzipped copy process_data.py writes over a plain one from older runs.
+    """
+    json_path = os.path.join(PROCESSED_DIR, name, 'aggregated.json')
+    for path in (json_path + '.gz', json_path):
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_json_file(path):
+    """Read a JSON file that is already in response shape without re-encoding it"""
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if path.endswith('.gz'):
+        payload = gzip.decompress(payload)
+    return payload
+
+def write_file_atomic(path, payload):
+    """Write bytes to path via a temp file so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Result of the last ensure_data_processed() filesystem check, reused for a few seconds
+_PROCESSED_CHECK = {'checked_at': None, 'value': False}
+PROCESSED_CHECK_TTL = 5
 
 def ensure_data_processed():
     """
     Checks if processed data exists.
     """
-    if not os.path.exists(PROCESSED_DIR) or not os.listdir(PROCESSED_DIR):
-        return False
-    return True
+    now = time.monotonic()
+    checked_at = _PROCESSED_CHECK['checked_at']
+    if checked_at is not None and now - checked_at < PROCESSED_CHECK_TTL:
+        return _PROCESSED_CHECK['value']
+    
+    # Stop at the first entry instead of listing the whole directory; the app's
+    # own _total cache doesn't count as processed data
+    try:
+        with os.scandir(PROCESSED_DIR) as it:
+            processed = any(entry.path != TOTAL_CACHE_DIR for entry in it)
+    except OSError:
+        processed = False
+    
+    _PROCESSED_CHECK['value'] = processed
+    _PROCESSED_CHECK['checked_at'] = now
+    return processed
 
 @app.route('/')
 def index():
@@ -33,32 +165,44 @@ def index():
     return render_template('index.html')
 
 def parse_date(date_str):
-    if not date_str:
+    if not date_str or len(date_str) < 10:
+        return None
+    # Standardize date format: sometimes Apple Health export or CSVs might have different lengths
+    # Just grab the date part YYYY-MM-DD
+    return _parse_day(date_str[:10])
+
+@functools.lru_cache(maxsize=4096)
+def _parse_day(day):
+    """Parse a YYYY-MM-DD string by slicing; memoized since rows repeat days"""
+    if day[4] != '-' or day[7] != '-':
         return None
     try:
-        # Standardize date format: sometimes Apple Health export or CSVs might have different lengths
-        # Just grab the date part YYYY-MM-DD
-        return datetime.strptime(date_str[:10], '%Y-%m-%d')
-    except:
+        return datetime(int(day[0:4]), int(day[5:7]), int(day[8:10]))
+    except ValueError:
         return None
 
+def date_bound(date_str):
+    """The YYYY-MM-DD prefix of a date filter parameter, or None if it isn't a valid date"""
+    return date_str[:10] if parse_date(date_str) else None
+
 def categorize_activity(activity_name):
     """Map Apple Health activity types to Strength Training or Cardio"""
     if not activity_name:
         return 'Cardio'
     
-    strength_keywords = {'strength', 'core', 'bodyweight', 'yoga', 'mindandbody', 'resistance'}
     lower_name = activity_name.lower()
-    
-    for kw in strength_keywords:
-        if kw in lower_name:
-            return 'Strength Training'
-            
+    if any(kw in lower_name for kw in STRENGTH_KEYWORDS):
+        return 'Strength Training'
     return 'Cardio'
 
 def safe_float(value, default=0.0):
-    if value is None:
+    if value is None or value == '':
         return default
+    try:
+        # Plain numbers, the common case, parse without any string cleanup
+        return float(value)
+    except (ValueError, TypeError):
+        pass
     try:
         # Handle cases with units or spaces
         clean_val = str(value).split()[0].replace(',', '')
@@ -66,10 +210,47 @@ def safe_float(value, default=0.0):
     except (ValueError, IndexError):
         return default
 
+# Read buffer for CSV files; fewer read() calls on multi-MB sample files
+CSV_BUFFER_SIZE = 1 << 20
+
+def open_csv(csv_path):
+    """Open a processed CSV for csv.reader (newline='' leaves line endings to the csv module)"""
+    return open(csv_path, 'r', encoding='utf-8-sig', errors='replace',
+                newline='', buffering=CSV_BUFFER_SIZE)
+
+# Columns the workout endpoints read from workouts.csv
+WORKOUT_COLUMNS = ('startDate', 'duration',
+                   'stat_ActiveEnergyBurned_sum', 'totalEnergyBurned',
+                   'stat_DistanceWalkingRunning_sum', 'totalDistance')
+
+def read_csv_columns(f, *names):
+    """
+    Iterate an open CSV file as tuples of the named columns (two or more). The
+    header is resolved to indices once; missing columns and short rows read as ''.
+    """
+    reader = csv.reader(f)
+    header = next(reader, [])
+    width = len(header)
+    idx = {name: i for i, name in enumerate(header)}
+    
+    # Missing columns point one past the header, at an empty slot appended to each row
+    cols = [idx.get(name, width) for name in names]
+    pick = itemgetter(*cols)
+    has_missing = width in cols
+    padding = [''] * width
+    
+    for row in reader:
+        if len(row) != width:
+            # Pad short rows and drop extra fields, as DictReader would
+            row = (row + padding)[:width]
+        if has_missing:
+            row.append('')
+        yield pick(row)
+
 def aggregate_metric_by_date(csv_path, date_col, val_col, start_date_str, end_date_str, dataset_name, granularity='monthly'):
     """Helper to aggregate CSV data by month or day with date range filtering"""
-    start_date = parse_date(start_date_str)
-    end_date = parse_date(end_date_str)
+    start_day = date_bound(start_date_str)
+    end_day = date_bound(end_date_str)
     
     # Structure: all_data[year][label] += value
     all_data = defaultdict(lambda: defaultdict(float))
@@ -77,40 +258,42 @@ def aggregate_metric_by_date(csv_path, date_col, val_col, start_date_str, end_da
     if not os.path.exists(csv_path):
         return []
 
-    with open(csv_path, 'r', encoding='utf-8-sig', errors='replace') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                dt_str = row.get(date_col, '')
-                dt = parse_date(dt_str)
-                if not dt: continue
-                
-                if start_date and dt < start_date: continue
-                if end_date and dt > end_date: continue
-                
-                year = dt.year
+    # Reduce rows to one subtotal per raw date prefix first, so the date
+    # handling below runs once per distinct day instead of once per sample
+    day_totals = defaultdict(float)
+    with open_csv(csv_path) as f:
+        for dt_str, value in read_csv_columns(f, date_col, val_col):
+            day_totals[dt_str[:10]] += safe_float(value)
+    
+    for day, total in day_totals.items():
+        try:
+            # YYYY-MM-DD strings order like the dates, so filter before parsing
+            if start_day and day < start_day: continue
+            if end_day and day > end_day: continue
+            
+            dt = parse_date(day)
+            if not dt: continue
+            
+            year = dt.year
+            
+            if granularity == 'daily':
+                label = day
+            else:
+                label = MONTH_ORDER[dt.month - 1]
                 
-                if granularity == 'daily':
-                    label = dt.strftime('%Y-%m-%d')
-                else:
-                    label = dt.strftime('%B')
-                    
-                all_data[year][label] += safe_float(row.get(val_col, 0))
-            except:
-                continue
+            all_data[year][label] += total
+        except:
+            continue
     
     # Format results
     formatted_result = []
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                  'July', 'August', 'September', 'October', 'November', 'December']
-                  
     for year in sorted(all_data.keys()):
         year_data = all_data[year]
         
         if granularity == 'daily':
             sorted_labels = sorted(year_data.keys())
         else:
-            sorted_labels = [m for m in month_order if m in year_data]
+            sorted_labels = [m for m in MONTH_ORDER if m in year_data]
             
         values = [year_data[lbl] for lbl in sorted_labels]
         
@@ -126,44 +309,55 @@ def aggregate_metric_by_date(csv_path, date_col, val_col, start_date_str, end_da
 
 def aggregate_heart_rate_by_date(csv_path, start_date_str, end_date_str):
     """Special helper for heart rate aggregation"""
-    start_date = parse_date(start_date_str)
-    end_date = parse_date(end_date_str)
+    start_day = date_bound(start_date_str)
+    end_day = date_bound(end_date_str)
     
-    # Store lists of values to calculate avg and max
-    vals = defaultdict(lambda: defaultdict(list))
+    # Store [sum, count, max] to calculate avg and max
+    vals = defaultdict(lambda: defaultdict(lambda: [0.0, 0, 0.0]))
     
     if not os.path.exists(csv_path):
         return []
 
-    with open(csv_path, 'r', encoding='utf-8-sig', errors='replace') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                dt_str = row.get('startDate', '')
-                dt = parse_date(dt_str)
-                if not dt: continue
-                
-                if start_date and dt < start_date: continue
-                if end_date and dt > end_date: continue
-                
-                year = dt.year
-                month = dt.strftime('%B')
-                val = safe_float(row.get('value', 0))
-                if val > 0:
-                    vals[year][month].append(val)
-            except:
-                continue
+    # Reduce samples to [sum, count, max] per raw date prefix first, so the
+    # date handling below runs once per distinct day instead of once per sample
+    day_stats = {}
+    with open_csv(csv_path) as f:
+        for dt_str, value in read_csv_columns(f, 'startDate', 'value'):
+            val = safe_float(value)
+            if val > 0:
+                day = dt_str[:10]
+                stats = day_stats.get(day)
+                if stats is None:
+                    day_stats[day] = [val, 1, val]
+                else:
+                    stats[0] += val
+                    stats[1] += 1
+                    if val > stats[2]:
+                        stats[2] = val
+    
+    for day, (total, count, peak) in day_stats.items():
+        try:
+            if start_day and day < start_day: continue
+            if end_day and day > end_day: continue
+            
+            dt = parse_date(day)
+            if not dt: continue
+            
+            month_stats = vals[dt.year][MONTH_ORDER[dt.month - 1]]
+            month_stats[0] += total
+            month_stats[1] += count
+            if peak > month_stats[2]:
+                month_stats[2] = peak
+        except:
+            continue
                 
     result = []
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                  'July', 'August', 'September', 'October', 'November', 'December']
-                  
     for year in sorted(vals.keys()):
         months_data = vals[year]
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months = [m for m in MONTH_ORDER if m in months_data]
         
-        avg_hr = [round(sum(months_data[m])/len(months_data[m]), 1) for m in sorted_months]
-        max_hr = [max(months_data[m]) for m in sorted_months]
+        avg_hr = [round(months_data[m][0] / months_data[m][1], 1) for m in sorted_months]
+        max_hr = [months_data[m][2] for m in sorted_months]
         
         result.append({
             'year': year,
@@ -178,12 +372,9 @@ def aggregate_heart_rate_by_date(csv_path, start_date_str, end_date_str):
 def format_monthly_data(all_data, dataset_name):
     """Generic monthly data formatter"""
     formatted_result = []
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                  'July', 'August', 'September', 'October', 'November', 'December']
-                  
     for year in sorted(all_data.keys()):
         months_data = all_data[year]
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months = [m for m in MONTH_ORDER if m in months_data]
         values = [months_data[m] for m in sorted_months]
         
         formatted_result.append({
@@ -195,23 +386,168 @@ def format_monthly_data(all_data, dataset_name):
         })
     return formatted_result
 
+def read_workout_rows(activity):
+    """Read (date, startDate, duration, energy, distance) tuples from an activity's workouts.csv"""
+    rows = []
+    csv_path = os.path.join(PROCESSED_DIR, activity, 'workouts.csv')
+    try:
+        with open_csv(csv_path) as f:
+            for dt_str, duration, stat_energy, energy, stat_distance, distance in read_csv_columns(f, *WORKOUT_COLUMNS):
+                try:
+                    dt = parse_date(dt_str)
+                    if not dt: continue
+                    
+                    rows.append((
+                        dt,
+                        dt_str,
+                        safe_float(duration),
+                        safe_float(stat_energy or energy),
+                        safe_float(stat_distance or distance)
+                    ))
+                except:
+                    continue
+    except FileNotFoundError:
+        pass
+    return rows
+
+# Parsed workouts.csv rows per activity: activity -> (mtime_ns, rows)
+WORKOUT_ROWS_CACHE = {}
+
+def load_workouts(activity, mtime):
+    """Return read_workout_rows(activity), re-reading only when workouts.csv's mtime changes"""
+    cached = WORKOUT_ROWS_CACHE.get(activity)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    rows = read_workout_rows(activity)
+    WORKOUT_ROWS_CACHE[activity] = (mtime, rows)
+    return rows
+
+@functools.lru_cache(maxsize=1)
+def _list_processed_dirs(mtime):
+    """Subdirectory names of PROCESSED_DIR; mtime only keys the cache"""
+    with os.scandir(PROCESSED_DIR) as it:
+        return tuple(entry.name for entry in it if entry.is_dir())
+
+def list_processed_dirs():
+    """
+    Subdirectories of PROCESSED_DIR, re-listed only when the directory's mtime
+    changes (i.e. an entry was added, removed or renamed).
+    """
+    try:
+        return _list_processed_dirs(os.stat(PROCESSED_DIR).st_mtime_ns)
+    except FileNotFoundError:
+        return ()
+
+def load_snapshot_workouts(snapshot):
+    """
+    Yield (activity, rows) for every activity in a scan_activities() snapshot
+    that has a workouts.csv, reading the files in parallel.
+    """
+    activities = [act for act, mtime in snapshot.items() if mtime is not None]
+    mtimes = [snapshot[act] for act in activities]
+    return zip(activities, READ_EXECUTOR.map(load_workouts, activities, mtimes))
+
+def cached_json(inputs):
+    """
+    Cache a view's encoded JSON per request URL and the state of the files it
+    reads. inputs() returns that state (hashable) and is passed on to the view,
+    which returns payload bytes; this wraps them in the response.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            state = inputs()
+            # Today's date is part of the key since streaks are relative to it
+            key = (request.full_path, state, datetime.now().date())
+            payload = cache_get(RESPONSE_CACHE, key)
+            if payload is None:
+                payload = view(state, *args, **kwargs)
+                cache_put(RESPONSE_CACHE, key, payload)
+            return raw_json_response(payload)
+        return wrapper
+    return decorator
+
+def processed_dir_mtime():
+    """mtime_ns of PROCESSED_DIR, or None if it doesn't exist"""
+    return file_mtime(PROCESSED_DIR)
+
 @app.route('/api/activities')
-def get_activities():
-    ensure_data_processed()
-    if not os.path.exists(PROCESSED_DIR):
-        return jsonify([])
-    
+@cached_json(processed_dir_mtime)
+def get_activities(dir_mtime):
     # Filter out special directories (sleep, steps, heart_rate)
-    special_dirs = {'sleep', 'steps', 'heart_rate'}
-    activities = [d for d in os.listdir(PROCESSED_DIR) 
-                  if os.path.isdir(os.path.join(PROCESSED_DIR, d)) and d not in special_dirs]
-    return jsonify(sorted(activities))
+    activities = sorted(name for name in list_processed_dirs() if name not in SPECIAL_DIRS)
+    return dump_json(activities)
+
+def file_mtime(path):
+    """mtime_ns of path, or None if it doesn't exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, ValueError):
+        return None
+
+def workouts_mtime(activity):
+    """mtime_ns of an activity's workouts.csv, or None if it doesn't exist"""
+    return file_mtime(os.path.join(PROCESSED_DIR, activity, 'workouts.csv'))
+
+def metric_mtimes(name):
+    """
+    mtime_ns of everything a sleep/steps/heart_rate view reads: its gzipped and
+    plain aggregates and its CSV (None for each that doesn't exist).
+    """
+    metric_dir = os.path.join(PROCESSED_DIR, name)
+    return tuple(file_mtime(os.path.join(metric_dir, f))
+                 for f in ('aggregated.json.gz', 'aggregated.json', name + '.csv'))
+
+def scan_activities():
+    """
+    Snapshot every activity directory: name -> workouts.csv mtime_ns (None when
+    the directory has no CSV).
+    """
+    return {
+        name: workouts_mtime(name)
+        for name in list_processed_dirs()
+        if name not in SPECIAL_DIRS
+    }
+
+def snapshot_items():
+    """scan_activities() as a tuple of (name, mtime_ns) items, usable as a cache key"""
+    return tuple(scan_activities().items())
+
+def data_snapshot():
+    """
+    The workouts.csv snapshot /api/data reads: every activity for Total, just the
+    requested one otherwise.
+    """
+    activity = request.args.get('activity')
+    if not activity:
+        return ()
+    if activity == 'Total':
+        return snapshot_items()
+    return ((activity, workouts_mtime(activity)),)
+
+def workouts_signature(mtimes):
+    """Summarize workouts.csv mtimes (newest, count) for cache keys"""
+    mtimes = [m for m in mtimes if m is not None]
+    return f"{max(mtimes, default=0)}:{len(mtimes)}"
+
+# Stats for a bucket with no workouts under a label
+EMPTY_STATS = (0, 0.0, 0.0, 0.0)
 
-# Simple in-memory cache: activity_name -> formatted_data
-DATA_CACHE = {}
+# /api/data metric names in stats-slot order; averages divide a slot by the count
+METRICS = ('count', 'duration', 'energy', 'distance')
+AVG_METRICS = (('avg_duration', 1), ('avg_energy', 2))
+ALL_METRICS = METRICS + tuple(m for m, _ in AVG_METRICS)
+
+def series_metrics(cells):
+    """Rounded per-label values of every metric for one series of stats cells"""
+    values = {m: [round(c[i], 1) for c in cells] for i, m in enumerate(METRICS)}
+    for m_avg, i in AVG_METRICS:
+        values[m_avg] = [round(c[i] / c[0], 1) if c[0] > 0 else 0 for c in cells]
+    return values
 
 @app.route('/api/data')
-def data():
+@cached_json(data_snapshot)
+def data(snapshot):
     activity = request.args.get('activity')
     start_date_str = request.args.get('start_date', '')
     end_date_str = request.args.get('end_date', '')
@@ -219,163 +555,131 @@ def data():
     group_by_category = request.args.get('group_by_category') == 'true'
     
     if not activity:
-        return jsonify([])
+        return dump_json([])
     
     start_date = parse_date(start_date_str)
     end_date = parse_date(end_date_str)
     
-    # Simple in-memory cache skip for variety of params
-    if not (start_date_str or end_date_str or granularity != 'monthly' or group_by_category) and activity in DATA_CACHE:
-        return jsonify(DATA_CACHE[activity])
-    
-    # all_data[year][label][bucket_name] = stats
-    # bucket_name will be activity name or category name
-    all_data = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: {
-        'count': 0,
-        'duration': 0.0,
-        'energy': 0.0,
-        'distance': 0.0
-    })))
+    # One filesystem snapshot per request: activity -> workouts.csv mtime (None if missing)
+    snapshot = dict(snapshot)
     
-    activities_to_process = []
-    if activity == 'Total':
-        special_dirs = {'sleep', 'steps', 'heart_rate'}
-        if os.path.exists(PROCESSED_DIR):
-            activities_to_process = [d for d in os.listdir(PROCESSED_DIR) if d not in special_dirs]
-    else:
-        activities_to_process = [activity]
+    # The unfiltered Total is also persisted to disk, keyed by the inputs' mtimes
+    signature = workouts_signature(snapshot.values())
+    persist_total = activity == 'Total' and bool(snapshot) and not (start_date_str or end_date_str or granularity != 'monthly' or group_by_category)
+    if persist_total:
+        try:
+            with open(TOTAL_CACHE_FILE + '.meta', 'r') as f:
+                if f.read() == signature:
+                    with open(TOTAL_CACHE_FILE, 'rb') as f:
+                        payload = f.read()
+                    return payload
+        except OSError:
+            pass
 
-    for act in activities_to_process:
-        csv_path = os.path.join(PROCESSED_DIR, act, 'workouts.csv')
-        if os.path.exists(csv_path):
-            with open(csv_path, 'r', encoding='utf-8-sig', errors='replace') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        dt_str = row.get('startDate', '')
-                        dt = parse_date(dt_str)
-                        if not dt: continue
-                        
-                        if start_date and dt < start_date: continue
-                        if end_date and dt > end_date: continue
-                        
-                        year = dt.year
-                        label = dt.strftime('%Y-%m-%d') if granularity == 'daily' else dt.strftime('%B')
-                        
-                        # Decide bucket
-                        bucket = categorize_activity(act) if group_by_category else act
-                        
-                        stats = all_data[year][label][bucket]
-                        stats['count'] += 1
-                        stats['duration'] += safe_float(row.get('duration', 0))
-                        stats['energy'] += safe_float(row.get('stat_ActiveEnergyBurned_sum') or row.get('totalEnergyBurned') or 0)
-                        stats['distance'] += safe_float(row.get('stat_DistanceWalkingRunning_sum') or row.get('totalDistance') or 0)
-                    except:
-                        continue
+    # acc[(year, label, bucket_name)] = [count, duration, energy, distance]
+    # bucket_name will be activity name or category name, label is the
+    # month index (0-11) for monthly granularity or the date for daily
+    acc = {}
+    
+    # Files are read in parallel; aggregation stays on this thread
+    # Locals for the per-row loop
+    acc_get = acc.get
+    daily = granularity == 'daily'
+    for act, rows in load_snapshot_workouts(snapshot):
+        # Decide bucket; it only depends on the activity, not the row
+        bucket = categorize_activity(act) if group_by_category else act
+        
+        for dt, dt_str, duration, energy, distance in rows:
+            if start_date and dt < start_date: continue
+            if end_date and dt > end_date: continue
+            
+            label = dt_str[:10] if daily else dt.month - 1
+            
+            key = (dt.year, label, bucket)
+            stats = acc_get(key)
+            if stats is None:
+                stats = acc[key] = [0, 0.0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] += energy
+            stats[3] += distance
 
+    # Regroup per year/label with one sorted traversal, so years and labels
+    # come out in order and never need sorting again
+    all_data = {}
+    for (year, label, bucket), stats in sorted(acc.items()):
+        all_data.setdefault(year, {}).setdefault(label, {})[bucket] = stats
+    
     # Format result
     formatted_result = []
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                  'July', 'August', 'September', 'October', 'November', 'December']
-                  
-    for year in sorted(all_data.keys()):
-        year_data = all_data[year]
-        sorted_labels = sorted(year_data.keys()) if granularity == 'daily' else [m for m in month_order if m in year_data]
-        
-        datasets = {
-            'count': {}, 'duration': {}, 'energy': {}, 'distance': {},
-            'avg_duration': {}, 'avg_energy': {}
-        }
-        
-        # Collect all buckets present in this year
-        found_buckets = set()
-        for label in sorted_labels:
-            for b in year_data[label]:
-                found_buckets.add(b)
-        
-        metrics = ['count', 'duration', 'energy', 'distance']
-        avg_metrics = [('avg_duration', 'duration'), ('avg_energy', 'energy')]
+    for year, year_data in all_data.items():
+        sorted_labels = list(year_data)
+        labels = sorted_labels if daily else [MONTH_ORDER[i] for i in sorted_labels]
         
         # If activity is Total or group_by_category is enabled
         if activity == 'Total' or group_by_category:
-            all_m = metrics + [am[0] for am in avg_metrics]
-            buckets_to_show = sorted(found_buckets)
+            # Collect all buckets present in this year
+            buckets_to_show = sorted({b for cells in year_data.values() for b in cells})
             
-            for m in all_m:
-                datasets[m]['Total'] = []
-                for b in buckets_to_show:
-                    datasets[m][b] = []
-                
-            for label in sorted_labels:
-                totals = {m: 0 for m in metrics}
-                for b in buckets_to_show:
-                    b_stats = year_data[label][b]
-                    for m in metrics:
-                        val = b_stats[m]
-                        datasets[m][b].append(round(val, 1))
-                        totals[m] += val
-                    
-                    # Individual bucket averages
-                    c = b_stats['count']
-                    for m_avg, m_sum in avg_metrics:
-                        datasets[m_avg][b].append(round(b_stats[m_sum] / c, 1) if c > 0 else 0)
-                
-                # Append Overall Totals
-                for m in metrics:
-                    datasets[m]['Total'].append(round(totals[m], 1))
-                total_c = totals['count']
-                for m_avg, m_sum in avg_metrics:
-                    datasets[m_avg]['Total'].append(round(totals[m_sum] / total_c, 1) if total_c > 0 else 0)
+            # Label x bucket grid, stored per bucket so each column is one series
+            columns = [
+                [year_data[label].get(b, EMPTY_STATS) for label in sorted_labels]
+                for b in buckets_to_show
+            ]
+            # Overall totals per label, summed across the buckets in order
+            totals = [tuple(map(sum, zip(*row))) for row in zip(*columns)]
+            
+            series = [('Total', series_metrics(totals))]
+            series += [(b, series_metrics(col)) for b, col in zip(buckets_to_show, columns)]
+            datasets = {m: {name: values[m] for name, values in series} for m in ALL_METRICS}
         else:
             # Single activity, no categorization
-            for m in metrics:
-                datasets[m] = [round(year_data[label][activity][m], 1) for label in sorted_labels]
-            for m_avg, m_sum in avg_metrics:
-                datasets[m_avg] = [
-                    round(year_data[label][activity][m_sum] / year_data[label][activity]['count'], 1) 
-                    if year_data[label][activity]['count'] > 0 else 0 
-                    for label in sorted_labels
-                ]
+            datasets = series_metrics([year_data[label][activity] for label in sorted_labels])
         
         formatted_result.append({
             'year': year,
-            'labels': sorted_labels,
+            'labels': labels,
             'datasets': datasets
         })
     
-    if not (start_date_str or end_date_str or granularity != 'monthly' or group_by_category):
-        DATA_CACHE[activity] = formatted_result
+    payload = dump_json(formatted_result)
+    if persist_total:
+        try:
+            # mkdir rather than makedirs, so a missing PROCESSED_DIR is never created here
+            if not os.path.isdir(TOTAL_CACHE_DIR):
+                os.mkdir(TOTAL_CACHE_DIR)
+            write_file_atomic(TOTAL_CACHE_FILE, payload)
+            write_file_atomic(TOTAL_CACHE_FILE + '.meta', signature.encode('utf-8'))
+        except OSError as e:
+            app.logger.warning("Could not persist Total aggregate: %s", e)
         
-    return jsonify(formatted_result)
+    return payload
 
 @app.route('/api/sleep')
-def get_sleep_data():
+@cached_json(functools.partial(metric_mtimes, 'sleep'))
+def get_sleep_data(mtimes):
     """Get sleep data with date filtering"""
     start_date_str = request.args.get('start_date', '')
     end_date_str = request.args.get('end_date', '')
     
-    json_path = os.path.join(PROCESSED_DIR, 'sleep', 'aggregated.json')
-    if not os.path.exists(json_path):
-        return jsonify([])
-        
-    with open(json_path, 'r') as f:
-        data = json.load(f)
+    json_path = find_aggregate('sleep')
+    if not json_path:
+        return dump_json([])
         
-    if not (start_date_str or end_date_str):
-        return jsonify(data)
-        
-    # If filtered, we need to recalculate from original source if possible, 
-    # but for now let's just filter the aggregated data by month if it fits,
-    # or better, look for the source CSV.
-    csv_path = os.path.join(PROCESSED_DIR, 'sleep', 'sleep.csv')
-    if os.path.exists(csv_path):
-        # Implement on-the-fly aggregation for filtered data
-        return jsonify(aggregate_metric_by_date(csv_path, 'startDate', 'value', start_date_str, end_date_str, 'sleep_hours'))
-        
-    return jsonify(data)
+    if start_date_str or end_date_str:
+        # If filtered, we need to recalculate from original source if possible, 
+        # but for now let's just filter the aggregated data by month if it fits,
+        # or better, look for the source CSV.
+        csv_path = os.path.join(PROCESSED_DIR, 'sleep', 'sleep.csv')
+        if os.path.exists(csv_path):
+            # Implement on-the-fly aggregation for filtered data
+            return dump_json(aggregate_metric_by_date(csv_path, 'startDate', 'value', start_date_str, end_date_str, 'sleep_hours'))
+    
+    return read_json_file(json_path)
 
 @app.route('/api/steps')
-def get_steps_data():
+@cached_json(functools.partial(metric_mtimes, 'steps'))
+def get_steps_data(mtimes):
     """Get steps data with date filtering and granularity"""
     start_date_str = request.args.get('start_date', '')
     end_date_str = request.args.get('end_date', '')
@@ -385,42 +689,60 @@ def get_steps_data():
     
     # If daily or filtered, stick to CSV aggregation for consistency
     if os.path.exists(csv_path) and (granularity == 'daily' or start_date_str or end_date_str):
-        return jsonify(aggregate_metric_by_date(csv_path, 'startDate', 'value', start_date_str, end_date_str, 'total_steps', granularity))
+        return dump_json(aggregate_metric_by_date(csv_path, 'startDate', 'value', start_date_str, end_date_str, 'total_steps', granularity))
 
-    json_path = os.path.join(PROCESSED_DIR, 'steps', 'aggregated.json')
-    if not os.path.exists(json_path):
-        return jsonify([])
-        
-    with open(json_path, 'r') as f:
-        data = json.load(f)
+    json_path = find_aggregate('steps')
+    if not json_path:
+        return dump_json([])
         
-    return jsonify(data)
+    return read_json_file(json_path)
 
 @app.route('/api/heart_rate')
-def get_heart_rate_data():
+@cached_json(functools.partial(metric_mtimes, 'heart_rate'))
+def get_heart_rate_data(mtimes):
     """Get heart rate data with date filtering"""
     start_date_str = request.args.get('start_date', '')
     end_date_str = request.args.get('end_date', '')
     
-    json_path = os.path.join(PROCESSED_DIR, 'heart_rate', 'aggregated.json')
-    if not os.path.exists(json_path):
-        return jsonify([])
-        
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-        
-    if not (start_date_str or end_date_str):
-        return jsonify(data)
-        
-    csv_path = os.path.join(PROCESSED_DIR, 'heart_rate', 'heart_rate.csv')
-    if os.path.exists(csv_path):
-        # Heart rate is special (avg and max)
-        return jsonify(aggregate_heart_rate_by_date(csv_path, start_date_str, end_date_str))
+    json_path = find_aggregate('heart_rate')
+    if not json_path:
+        return dump_json([])
         
-    return jsonify(data)
+    if start_date_str or end_date_str:
+        csv_path = os.path.join(PROCESSED_DIR, 'heart_rate', 'heart_rate.csv')
+        if os.path.exists(csv_path):
+            # Heart rate is special (avg and max)
+            return dump_json(aggregate_heart_rate_by_date(csv_path, start_date_str, end_date_str))
+    
+    return read_json_file(json_path)
+
+# (snapshot, (workouts, days)) for every workout across activities, rebuilt when
+# the workouts.csv snapshot changes. Replaced in a single assignment, so request
+# threads never see an index paired with another snapshot.
+_WORKOUT_INDEX = (None, None)
+
+def workout_index(snapshot):
+    """
+    Return (workouts, days) for a snapshot_items() snapshot: every workout as
+    (date, YYYY-MM-DD, duration, energy, distance, activity) in directory order,
+    plus the sorted distinct workout days as date ordinals.
+    Shared by /api/statistics and /api/personal_records.
+    """
+    global _WORKOUT_INDEX
+    indexed_snapshot, value = _WORKOUT_INDEX
+    if indexed_snapshot != snapshot:
+        workouts = []
+        for activity, rows in load_snapshot_workouts(dict(snapshot)):
+            for dt, dt_str, duration, energy, distance in rows:
+                workouts.append((dt, dt_str[:10], duration, energy, distance, activity))
+        days = sorted({w[0].toordinal() for w in workouts})
+        value = (workouts, days)
+        _WORKOUT_INDEX = (snapshot, value)
+    return value
 
 @app.route('/api/statistics')
-def get_statistics():
+@cached_json(snapshot_items)
+def get_statistics(snapshot):
     """
     Calculate and return summary statistics across all workouts
     Supports optional date range filtering via start_date and end_date parameters
@@ -459,74 +781,50 @@ def get_statistics():
     }
     
     if not os.path.exists(PROCESSED_DIR):
-        return jsonify(stats)
+        return dump_json(stats)
     
-    special_dirs = {'sleep', 'steps', 'heart_rate'}
     all_workouts = []
     
-    for activity_dir in os.listdir(PROCESSED_DIR):
-        if activity_dir in special_dirs:
+    workouts, _ = workout_index(snapshot)
+    for dt, _, duration, energy, distance, _ in workouts:
+        # Apply date range filter
+        if start_date and dt < start_date:
             continue
-        csv_path = os.path.join(PROCESSED_DIR, activity_dir, 'workouts.csv')
-        if os.path.exists(csv_path):
-            with open(csv_path, 'r', encoding='utf-8-sig', errors='replace') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        # Parse workout date
-                        dt_str = row.get('startDate', '')
-                        dt = parse_date(dt_str)
-                        if not dt: continue
-                        
-                        # Apply date range filter
-                        if start_date and dt < start_date:
-                            continue
-                        if end_date and dt > end_date:
-                            continue
-                        
-                        stats['total_workouts'] += 1
-                        
-                        stats['total_duration_minutes'] += safe_float(row.get('duration', 0))
-                        
-                        energy = row.get('stat_ActiveEnergyBurned_sum') or row.get('totalEnergyBurned') or 0
-                        stats['total_energy_burned'] += safe_float(energy)
-                        
-                        distance = row.get('stat_DistanceWalkingRunning_sum') or row.get('totalDistance') or 0
-                        stats['total_distance'] += safe_float(distance)
-                        
-                        all_workouts.append(dt_str[:10])
-                    except Exception as e:
-                        continue
+        if end_date and dt > end_date:
+            continue
+        
+        stats['total_workouts'] += 1
+        stats['total_duration_minutes'] += duration
+        stats['total_energy_burned'] += energy
+        stats['total_distance'] += distance
+        
+        all_workouts.append(dt)
     
     # Calculate averages
     if stats['total_workouts'] > 0:
         stats['avg_duration_per_workout'] = stats['total_duration_minutes'] / stats['total_workouts']
         
         # Calculate date range for averages
+        # Index rows carry the already-parsed day, so nothing is re-parsed here
         if all_workouts:
-            dates = [datetime.strptime(d, '%Y-%m-%d') for d in all_workouts]
-            if dates:
-                min_date = min(dates)
-                max_date = max(dates)
-                total_days = (max_date - min_date).days + 1
-                total_weeks = total_days / 7
-                total_months = total_days / 30.44
-                
-                if total_weeks > 0:
-                    stats['avg_workouts_per_week'] = stats['total_workouts'] / total_weeks
-                if total_months > 0:
-                    stats['avg_workouts_per_month'] = stats['total_workouts'] / total_months
-    
-    # Round values
-    for key in stats:
-        if isinstance(stats[key], (int, float)):
-            stats[key] = round(stats[key], 2)
+            min_date = min(all_workouts)
+            max_date = max(all_workouts)
+            total_days = (max_date - min_date).days + 1
+            total_weeks = total_days / 7
+            total_months = total_days / 30.44
+            
+            if total_weeks > 0:
+                stats['avg_workouts_per_week'] = stats['total_workouts'] / total_weeks
+            if total_months > 0:
+                stats['avg_workouts_per_month'] = stats['total_workouts'] / total_months
     
-    return jsonify(stats)
+    # Values are left unrounded; the dashboard formats them for display
+    return dump_json(stats)
 
 
 @app.route('/api/personal_records')
-def get_personal_records():
+@cached_json(snapshot_items)
+def get_personal_records(snapshot):
     """
     Calculate personal records with global streak support
     """
@@ -545,47 +843,28 @@ def get_personal_records():
     }
     
     if not os.path.exists(PROCESSED_DIR):
-        return jsonify(records)
+        return dump_json(records)
     
-    special_dirs = {'sleep', 'steps', 'heart_rate'}
     filtered_workouts = [] # For personal bests within range
-    global_workouts = []   # For current streak calculation
     monthly_counts = defaultdict(int)
     
-    for activity_dir in os.listdir(PROCESSED_DIR):
-        if activity_dir in special_dirs:
-            continue
+    # Streaks are computed over every workout day, regardless of the range
+    workouts, workout_days = workout_index(snapshot)
+    for dt, date_str, duration, _, _, activity_dir in workouts:
+        # Apply date range filter for personal records
+        if start_date and dt < start_date: continue
+        if end_date and dt > end_date: continue
         
-        csv_path = os.path.join(PROCESSED_DIR, activity_dir, 'workouts.csv')
-        if os.path.exists(csv_path):
-            with open(csv_path, 'r', encoding='utf-8-sig', errors='replace') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        dt_str = row.get('startDate', '')
-                        dt = parse_date(dt_str)
-                        if not dt: continue
-                        
-                        date_str = dt_str[:10]
-                        global_workouts.append(date_str)
-                        
-                        # Apply date range filter for personal records
-                        if start_date and dt < start_date: continue
-                        if end_date and dt > end_date: continue
-                        
-                        duration = safe_float(row.get('duration', 0))
-                        if duration > records['longest_workout']['duration']:
-                            records['longest_workout'] = {
-                                'duration': round(duration, 2),
-                                'activity': activity_dir,
-                                'date': date_str
-                            }
-                        
-                        filtered_workouts.append(date_str)
-                        month_key = f"{dt.strftime('%B')} {dt.year}"
-                        monthly_counts[month_key] += 1
-                    except:
-                        continue
+        if duration > records['longest_workout']['duration']:
+            records['longest_workout'] = {
+                'duration': round(duration, 2),
+                'activity': activity_dir,
+                'date': date_str
+            }
+        
+        filtered_workouts.append(date_str)
+        month_key = f"{MONTH_ORDER[dt.month - 1]} {dt.year}"
+        monthly_counts[month_key] += 1
     
     # Find most active month (within filtered range)
     if monthly_counts:
@@ -598,21 +877,16 @@ def get_personal_records():
         }
     
     # Calculate streaks
-    if global_workouts:
-        unique_dates = sorted(set(global_workouts))
-        workout_dates = [datetime.strptime(d, '%Y-%m-%d') for d in unique_dates]
-        
+    if workout_days:
         # Longest streak overall (or within range? User said streaks plural, 
         # but usually personal best is overall. Let's keep it global for now 
         # to ensure it's truly a 'record'.)
+        # Days are sorted ordinals, so consecutive days differ by exactly 1
         longest_streak = 0
         temp_streak = 1
         
-        today = datetime.now().date()
-        
-        for i in range(len(workout_dates) - 1):
-            diff = (workout_dates[i + 1] - workout_dates[i]).days
-            if diff == 1:
+        for prev, cur in zip(workout_days, workout_days[1:]):
+            if cur - prev == 1:
                 temp_streak += 1
             else:
                 longest_streak = max(longest_streak, temp_streak)
@@ -621,26 +895,17 @@ def get_personal_records():
         longest_streak = max(longest_streak, temp_streak)
         records['longest_streak'] = longest_streak
         
-        # Current streak (Global)
-        current_streak = 0
-        if workout_dates:
-            last_workout = workout_dates[-1].date()
-            # If today is 26th, and last workout was 25th or 26th, streak is alive
-            days_since = (today - last_workout).days
-            if days_since <= 1:
-                current_streak = 1
-                for i in range(len(workout_dates) - 2, -1, -1):
-                    diff = (workout_dates[i + 1] - workout_dates[i]).days
-                    if diff == 1:
-                        current_streak += 1
-                    else:
-                        break
-        records['current_streak'] = current_streak
-    
-    return jsonify(records)
+        # Current streak (Global): the run ending at the last workout day,
+        # which is temp_streak after the loop
+        # If today is 26th, and last workout was 25th or 26th, streak is alive
+        days_since = datetime.now().date().toordinal() - workout_days[-1]
+        records['current_streak'] = temp_streak if days_since <= 1 else 0
+    
+    return dump_json(records)
 
 @app.route('/api/workout_details')
-def get_workout_details():
+@cached_json(snapshot_items)
+def get_workout_details(snapshot):
     """
     Get detailed workout data with pagination and filtering
     """
@@ -653,53 +918,50 @@ def get_workout_details():
     start_date = parse_date(start_date_str)
     end_date = parse_date(end_date_str)
     
-    all_workouts = []
-    special_dirs = {'sleep', 'steps', 'heart_rate'}
+    snapshot = dict(snapshot)
+    if activity_filter:
+        snapshot = {activity_filter: snapshot.get(activity_filter)}
+    total = 0
     
-    for activity_dir in os.listdir(PROCESSED_DIR):
-        if activity_dir in special_dirs:
-            continue
-        if activity_filter and activity_dir != activity_filter:
-            continue
-            
-        csv_path = os.path.join(PROCESSED_DIR, activity_dir, 'workouts.csv')
-        if os.path.exists(csv_path):
-            with open(csv_path, 'r', encoding='utf-8-sig', errors='replace') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        dt_str = row.get('startDate', '')
-                        dt = parse_date(dt_str)
-                        if not dt: continue
-                        
-                        if start_date and dt < start_date: continue
-                        if end_date and dt > end_date: continue
-                        
-                        workout = {
-                            'activity': activity_dir,
-                            'startDate': dt_str,
-                            'duration': round(safe_float(row.get('duration', 0)), 2),
-                            'energy': round(safe_float(row.get('stat_ActiveEnergyBurned_sum') or row.get('totalEnergyBurned')), 2),
-                            'distance': round(safe_float(row.get('stat_DistanceWalkingRunning_sum') or row.get('totalDistance')), 2)
-                        }
-                        all_workouts.append(workout)
-                    except:
-                        continue
-    
-    # Sort by date (most recent first)
-    all_workouts.sort(key=lambda x: x['startDate'], reverse=True)
+    def matching_workouts():
+        nonlocal total
+        for activity_dir, rows in load_snapshot_workouts(snapshot):
+            for dt, dt_str, duration, energy, distance in rows:
+                if start_date and dt < start_date: continue
+                if end_date and dt > end_date: continue
+                
+                total += 1
+                yield (dt_str, activity_dir, duration, energy, distance)
     
     # Pagination
     start = (page - 1) * per_page
     end = start + per_page
-    paginated = all_workouts[start:end]
     
-    return jsonify({
+    # Most recent first; only the rows up to the end of this page are kept
+    by_start_date = itemgetter(0)
+    if start >= 0:
+        top = heapq.nlargest(end, matching_workouts(), key=by_start_date)
+    else:
+        top = sorted(matching_workouts(), key=by_start_date, reverse=True)
+    
+    # Only the rows on this page become dicts
+    paginated = [
+        {
+            'activity': activity_dir,
+            'startDate': dt_str,
+            'duration': round(duration, 2),
+            'energy': round(energy, 2),
+            'distance': round(distance, 2)
+        }
+        for dt_str, activity_dir, duration, energy, distance in top[start:end]
+    ]
+    
+    return dump_json({
         'data': paginated,
-        'total': len(all_workouts),
+        'total': total,
         'page': page,
         'per_page': per_page,
-        'total_pages': (len(all_workouts) + per_page - 1) // per_page
+        'total_pages': (total + per_page - 1) // per_page
     })
 
 if __name__ == '__main__':
@@ -1,9 +1,55 @@
-import xml.etree.ElementTree as ET
+import lxml.etree as ET
 import csv
+import functools
 import os
 from datetime import datetime
 from collections import defaultdict
 
+# Month names in calendar order, indexed by month number - 1
+MONTHS = ('January', 'February', 'March', 'April', 'May', 'June',
+          'July', 'August', 'September', 'October', 'November', 'December')
+
+@functools.lru_cache(maxsize=4096)
+def parse_year_month(day):
+    """
+    (year, month index 0-11) of a 'YYYY-MM-DD' string, read by slicing instead of
+    strptime. Raises ValueError for a date strptime would reject, including days
+    past the end of the month. Memoized, since samples repeat the same day many times.
+    """
+    if day[4:5] != '-' or day[7:8] != '-':
+        raise ValueError(f"Invalid date: {day}")
+    # datetime checks the day against the month and year, leap days included
+    _day_ordinal(day)
+    return int(day[0:4]), int(day[5:7]) - 1
+
+@functools.lru_cache(maxsize=4096)
+def _day_ordinal(day):
+    """Proleptic ordinal of a 'YYYY-MM-DD' string; memoized, datetime validates it"""
+    return datetime(int(day[0:4]), int(day[5:7]), int(day[8:10])).toordinal()
+
+def _seconds_of_day(timestamp):
+    """Seconds since midnight of a 'YYYY-MM-DD HH:MM:SS...' string"""
+    if timestamp[10:11] != ' ' or timestamp[13:14] != ':' or timestamp[16:17] != ':':
+        raise ValueError(f"Invalid timestamp: {timestamp[:19]}")
+    hours, minutes, seconds = int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])
+    if hours > 23 or minutes > 59 or seconds > 61:
+        raise ValueError(f"Invalid timestamp: {timestamp[:19]}")
+    return hours * 3600 + minutes * 60 + seconds
+
+def parse_minutes_between(start, end):
+    """
+    Minutes from start to end, both 'YYYY-MM-DD HH:MM:SS...' strings, computed by
+    slicing instead of building two datetimes with strptime.
+    """
+    days = _day_ordinal(end[:10]) - _day_ordinal(start[:10])
+    return (days * 86400 + _seconds_of_day(end) - _seconds_of_day(start)) / 60
+
+# Rows buffered per output file before they are flushed in one call: a
+# writerows() for workout rows, a single write() of the joined record lines
+WRITE_BATCH_SIZE = 10000
+# Write buffer for output files; large exports produce multi-MB CSVs
+WRITE_BUFFER_SIZE = 1 << 20
+
 def parse_workouts_to_csv(xml_file, output_dir='processed_data'):
     """
     Parses the Apple Health export XML file and generates CSV files for each activity type.
@@ -15,159 +61,178 @@ def parse_workouts_to_csv(xml_file, output_dir='processed_data'):
     # activity_type -> csv_writer
     csv_handles = {}
     csv_files = {}
+    # activity_type -> rows not yet handed to writerows
+    batches = {}
 
     try:
-        context = ET.iterparse(xml_file, events=('end',))
+        # Only Workout elements are materialized; the C parser skips everything else
+        context = ET.iterparse(xml_file, events=('end',), tag='Workout')
         
         for event, elem in context:
-            if elem.tag == 'Workout':
-                activity_type = elem.get('workoutActivityType')
-                if activity_type:
-                    # Strip prefix if present (e.g., HKWorkoutActivityTypeRunning -> Running)
-                    if activity_type.startswith('HKWorkoutActivityType'):
-                        activity_type = activity_type[len('HKWorkoutActivityType'):]
-                    
-                    # Create directory for activity if needed
+            # Bound once; the body below does all its attribute reads through it
+            get = elem.get
+            activity_type = get('workoutActivityType')
+            if activity_type:
+                # Strip prefix if present (e.g., HKWorkoutActivityTypeRunning -> Running)
+                if activity_type.startswith('HKWorkoutActivityType'):
+                    activity_type = activity_type[len('HKWorkoutActivityType'):]
+                
+                # Create the activity's directory and CSV the first time it's seen
+                if activity_type not in csv_handles:
                     activity_dir = os.path.join(output_dir, activity_type)
-                    if not os.path.exists(activity_dir):
-                        os.makedirs(activity_dir)
-                        
+                    os.makedirs(activity_dir, exist_ok=True)
                     csv_path = os.path.join(activity_dir, 'workouts.csv')
-                    
-                    # Initialize CSV if not already open
-                    if activity_type not in csv_handles:
-                        f = open(csv_path, 'w', newline='')
-                        writer = csv.writer(f)
-                        writer.writerow(['startDate', 'duration', 'totalEnergyBurned', 'totalDistance'])
-                        csv_files[activity_type] = f
-                        csv_handles[activity_type] = writer
-                    
-                    # Extract data
-                    start_date = elem.get('startDate')
-                    duration = elem.get('duration', '0')
-                    energy = elem.get('totalEnergyBurned', '0')
-                    distance = elem.get('totalDistance', '0')
-                    
-                    csv_handles[activity_type].writerow([start_date, duration, energy, distance])
+                    f = open(csv_path, 'w', newline='', buffering=WRITE_BUFFER_SIZE)
+                    writer = csv.writer(f)
+                    writer.writerow(['startDate', 'duration', 'totalEnergyBurned', 'totalDistance'])
+                    csv_files[activity_type] = f
+                    csv_handles[activity_type] = writer
+                    batches[activity_type] = []
+                
+                # Extract data straight into the row tuple
+                batch = batches[activity_type]
+                batch.append((
+                    get('startDate'),
+                    get('duration', '0'),
+                    get('totalEnergyBurned', '0'),
+                    get('totalDistance', '0')
+                ))
+                if len(batch) >= WRITE_BATCH_SIZE:
+                    csv_handles[activity_type].writerows(batch)
+                    batch.clear()
 
-                elem.clear()
+            # Free the element and its already-processed siblings
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            while elem.getprevious() is not None:
+                del parent[0]
         
     except Exception as e:
         print(f"Error parsing XML: {e}")
         raise e
     finally:
-        # Close all files
-        for f in csv_files.values():
+        # Flush remaining rows and close all files
+        for activity_type, f in csv_files.items():
+            csv_handles[activity_type].writerows(batches[activity_type])
             f.close()
 
-def parse_sleep_data(xml_file, output_dir='processed_data'):
+SLEEP_RECORD = 'HKCategoryTypeIdentifierSleepAnalysis'
+STEPS_RECORD = 'HKQuantityTypeIdentifierStepCount'
+HEART_RATE_RECORD = 'HKQuantityTypeIdentifierHeartRate'
+
+# Record type -> (output name, CSV header); each goes to <output_dir>/<name>/<name>.csv
+RECORD_OUTPUTS = {
+    SLEEP_RECORD: ('sleep', ['startDate', 'endDate', 'value', 'duration']),
+    STEPS_RECORD: ('steps', ['startDate', 'endDate', 'value']),
+    HEART_RATE_RECORD: ('heart_rate', ['startDate', 'value']),
+}
+
+def parse_records(xml_file, output_dir='processed_data', record_types=None):
     """
-    Parses sleep analysis data from Apple Health export.
-    Sleep data is stored as HKCategoryTypeIdentifierSleepAnalysis records.
+    Parses sleep, steps and heart rate records in a single pass over the export,
+    routing each record type to its own CSV. record_types limits which are written.
     """
-    sleep_dir = os.path.join(output_dir, 'sleep')
-    if not os.path.exists(sleep_dir):
-        os.makedirs(sleep_dir)
+    if record_types is None:
+        record_types = list(RECORD_OUTPUTS)
     
-    csv_path = os.path.join(sleep_dir, 'sleep.csv')
+    # record_type -> output file, and the lines not yet written to it.
+    # Fields are dates and numbers that never need CSV quoting, so lines are
+    # formatted directly (with csv.writer's \r\n terminator) instead of
+    # going through csv.writer. Each batch is joined and written in one call.
+    outputs = {}
+    batches = {}
+    files = []
     
-    with open(csv_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['startDate', 'endDate', 'value', 'duration'])
-        
-        try:
-            context = ET.iterparse(xml_file, events=('end',))
+    try:
+        for record_type in record_types:
+            name, header = RECORD_OUTPUTS[record_type]
+            record_dir = os.path.join(output_dir, name)
+            if not os.path.exists(record_dir):
+                os.makedirs(record_dir)
             
-            for event, elem in context:
-                if elem.tag == 'Record':
-                    record_type = elem.get('type')
-                    if record_type == 'HKCategoryTypeIdentifierSleepAnalysis':
-                        start_date = elem.get('startDate')
-                        end_date = elem.get('endDate')
-                        value = elem.get('value', '0')  # 0=InBed, 1=Asleep, 2=Awake
-                        
-                        # Calculate duration in minutes
-                        try:
-                            start = datetime.strptime(start_date[:19], '%Y-%m-%d %H:%M:%S')
-                            end = datetime.strptime(end_date[:19], '%Y-%m-%d %H:%M:%S')
-                            duration = (end - start).total_seconds() / 60
-                        except:
-                            duration = 0
-                        
-                        writer.writerow([start_date, end_date, value, duration])
+            f = open(os.path.join(record_dir, name + '.csv'), 'w', newline='',
+                     buffering=WRITE_BUFFER_SIZE)
+            files.append(f)
+            f.write(','.join(header) + '\r\n')
+            outputs[record_type] = f
+            batches[record_type] = []
+        
+        context = ET.iterparse(xml_file, events=('end',), tag='Record')
+        minutes_between = parse_minutes_between
+        
+        for event, elem in context:
+            get = elem.get
+            record_type = get('type')
+            batch = batches.get(record_type)
+            if batch is not None:
+                start_date = get('startDate', '')
+                value = get('value', '0')
+                
+                if record_type == SLEEP_RECORD:
+                    # value: 0=InBed, 1=Asleep, 2=Awake
+                    end_date = get('endDate', '')
                     
-                    elem.clear()
+                    # Calculate duration in minutes
+                    try:
+                        duration = minutes_between(start_date, end_date)
+                    except:
+                        duration = 0
                     
-        except Exception as e:
-            print(f"Error parsing sleep data: {e}")
-            raise e
+                    batch.append(f"{start_date},{end_date},{value},{duration}\r\n")
+                elif record_type == STEPS_RECORD:
+                    batch.append(f"{start_date},{get('endDate', '')},{value}\r\n")
+                else:
+                    batch.append(f"{start_date},{value}\r\n")
+                
+                if len(batch) >= WRITE_BATCH_SIZE:
+                    outputs[record_type].write(''.join(batch))
+                    batch.clear()
+            
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            while elem.getprevious() is not None:
+                del parent[0]
+                
+    except Exception as e:
+        print(f"Error parsing records: {e}")
+        raise e
+    finally:
+        for record_type, batch in batches.items():
+            outputs[record_type].write(''.join(batch))
+        for f in files:
+            f.close()
+
+def parse_sleep_data(xml_file, output_dir='processed_data'):
+    """
+    Parses sleep analysis data from Apple Health export.
+    Sleep data is stored as HKCategoryTypeIdentifierSleepAnalysis records.
+    """
+    parse_records(xml_file, output_dir, [SLEEP_RECORD])
 
 def parse_steps_data(xml_file, output_dir='processed_data'):
     """
     Parses step count data from Apple Health export.
     Steps are stored as HKQuantityTypeIdentifierStepCount records.
     """
-    steps_dir = os.path.join(output_dir, 'steps')
-    if not os.path.exists(steps_dir):
-        os.makedirs(steps_dir)
-    
-    csv_path = os.path.join(steps_dir, 'steps.csv')
-    
-    with open(csv_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['startDate', 'endDate', 'value'])
-        
-        try:
-            context = ET.iterparse(xml_file, events=('end',))
-            
-            for event, elem in context:
-                if elem.tag == 'Record':
-                    record_type = elem.get('type')
-                    if record_type == 'HKQuantityTypeIdentifierStepCount':
-                        start_date = elem.get('startDate')
-                        end_date = elem.get('endDate')
-                        value = elem.get('value', '0')
-                        
-                        writer.writerow([start_date, end_date, value])
-                    
-                    elem.clear()
-                    
-        except Exception as e:
-            print(f"Error parsing steps data: {e}")
-            raise e
+    parse_records(xml_file, output_dir, [STEPS_RECORD])
 
 def parse_heart_rate_data(xml_file, output_dir='processed_data'):
     """
     Parses heart rate data from Apple Health export.
     Heart rate is stored as HKQuantityTypeIdentifierHeartRate records.
     """
-    hr_dir = os.path.join(output_dir, 'heart_rate')
-    if not os.path.exists(hr_dir):
-        os.makedirs(hr_dir)
-    
-    csv_path = os.path.join(hr_dir, 'heart_rate.csv')
-    
-    with open(csv_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['startDate', 'value'])
-        
-        try:
-            context = ET.iterparse(xml_file, events=('end',))
-            
-            for event, elem in context:
-                if elem.tag == 'Record':
-                    record_type = elem.get('type')
-                    if record_type == 'HKQuantityTypeIdentifierHeartRate':
-                        start_date = elem.get('startDate')
-                        value = elem.get('value', '0')
-                        
-                        writer.writerow([start_date, value])
-                    
-                    elem.clear()
-                    
-        except Exception as e:
-            print(f"Error parsing heart rate data: {e}")
-            raise e
+    parse_records(xml_file, output_dir, [HEART_RATE_RECORD])
+
+def _column_indices(reader, names):
+    """
+    Indices of the named columns in reader's header row, or None when the file is
+    empty or lacks one of them (there is nothing to aggregate either way).
+    """
+    header = next(reader, [])
+    try:
+        return [header.index(name) for name in names]
+    except ValueError:
+        return None
 
 def aggregate_sleep_data(csv_path):
     """
@@ -183,26 +248,30 @@ def aggregate_sleep_data(csv_path):
         return aggregated_data
     
     with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        indices = _column_indices(reader, ('startDate', 'duration', 'value'))
+        if indices is None:
+            return aggregated_data
+        date_idx, duration_idx, value_idx = indices
+        year_month = parse_year_month
+        months = MONTHS
         for row in reader:
             try:
-                start_date_str = row['startDate']
-                date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                year = date_obj.year
-                month = date_obj.strftime('%B')
+                start_date_str = row[date_idx]
+                year, month = year_month(start_date_str[:10])
                 
-                duration = float(row['duration'])
-                value = row['value']
+                duration = float(row[duration_idx])
+                value = row[value_idx]
                 
                 # value: 0=InBed, 1=Asleep, 2=Awake
                 if value == '1':  # Asleep
-                    aggregated_data[year][month]['total_sleep_minutes'] += duration
+                    aggregated_data[year][months[month]]['total_sleep_minutes'] += duration
                 elif value == '0':  # InBed
-                    aggregated_data[year][month]['in_bed_minutes'] += duration
+                    aggregated_data[year][months[month]]['in_bed_minutes'] += duration
                 elif value == '2':  # Awake
-                    aggregated_data[year][month]['awake_minutes'] += duration
+                    aggregated_data[year][months[month]]['awake_minutes'] += duration
                     
-            except (ValueError, KeyError):
+            except (ValueError, IndexError):
                 continue
     
     return aggregated_data
@@ -220,19 +289,24 @@ def aggregate_steps_data(csv_path):
         return aggregated_data
     
     with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        indices = _column_indices(reader, ('startDate', 'value'))
+        if indices is None:
+            return aggregated_data
+        date_idx, value_idx = indices
+        year_month = parse_year_month
+        months = MONTHS
         for row in reader:
             try:
-                start_date_str = row['startDate']
-                date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                year = date_obj.year
-                month = date_obj.strftime('%B')
+                start_date_str = row[date_idx]
+                year, month = year_month(start_date_str[:10])
                 
-                steps = int(float(row['value']))
-                aggregated_data[year][month]['total_steps'] += steps
-                aggregated_data[year][month]['count'] += 1
+                steps = int(float(row[value_idx]))
+                stats = aggregated_data[year][months[month]]
+                stats['total_steps'] += steps
+                stats['count'] += 1
                 
-            except (ValueError, KeyError):
+            except (ValueError, IndexError):
                 continue
     
     return aggregated_data
@@ -252,21 +326,28 @@ def aggregate_heart_rate_data(csv_path):
         return aggregated_data
     
     with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        indices = _column_indices(reader, ('startDate', 'value'))
+        if indices is None:
+            return aggregated_data
+        date_idx, value_idx = indices
+        year_month = parse_year_month
+        months = MONTHS
         for row in reader:
             try:
-                start_date_str = row['startDate']
-                date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                year = date_obj.year
-                month = date_obj.strftime('%B')
+                start_date_str = row[date_idx]
+                year, month = year_month(start_date_str[:10])
                 
-                hr = float(row['value'])
-                aggregated_data[year][month]['sum'] += hr
-                aggregated_data[year][month]['count'] += 1
-                aggregated_data[year][month]['min'] = min(aggregated_data[year][month]['min'], hr)
-                aggregated_data[year][month]['max'] = max(aggregated_data[year][month]['max'], hr)
+                hr = float(row[value_idx])
+                stats = aggregated_data[year][months[month]]
+                stats['sum'] += hr
+                stats['count'] += 1
+                if hr < stats['min']:
+                    stats['min'] = hr
+                if hr > stats['max']:
+                    stats['max'] = hr
                 
-            except (ValueError, KeyError):
+            except (ValueError, IndexError):
                 continue
     
     return aggregated_data
@@ -280,13 +361,11 @@ def format_sleep_data(aggregated_data):
     
     for year in sorted_years:
         months_data = aggregated_data[year]
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months = [m for m in MONTHS if m in months_data]
         
-        sleep_hours = [months_data[m]['total_sleep_minutes'] / 60 for m in sorted_months]
-        in_bed_hours = [months_data[m]['in_bed_minutes'] / 60 for m in sorted_months]
+        rows = [months_data[m] for m in sorted_months]
+        sleep_hours = [r['total_sleep_minutes'] / 60 for r in rows]
+        in_bed_hours = [r['in_bed_minutes'] / 60 for r in rows]
         
         result.append({
             'year': year,
@@ -308,10 +387,7 @@ def format_steps_data(aggregated_data):
     
     for year in sorted_years:
         months_data = aggregated_data[year]
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months = [m for m in MONTHS if m in months_data]
         
         total_steps = [months_data[m]['total_steps'] for m in sorted_months]
         
@@ -334,16 +410,12 @@ def format_heart_rate_data(aggregated_data):
     
     for year in sorted_years:
         months_data = aggregated_data[year]
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months = [m for m in MONTHS if m in months_data]
         
-        avg_hr = [months_data[m]['sum'] / months_data[m]['count'] if months_data[m]['count'] > 0 else 0 
-                  for m in sorted_months]
-        min_hr = [months_data[m]['min'] if months_data[m]['min'] != float('inf') else 0 
-                  for m in sorted_months]
-        max_hr = [months_data[m]['max'] for m in sorted_months]
+        rows = [months_data[m] for m in sorted_months]
+        avg_hr = [r['sum'] / r['count'] if r['count'] > 0 else 0 for r in rows]
+        min_hr = [r['min'] if r['min'] != float('inf') else 0 for r in rows]
+        max_hr = [r['max'] for r in rows]
         
         result.append({
             'year': year,
@@ -372,19 +444,24 @@ def aggregate_from_csv(csv_path):
         return aggregated_data
 
     with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        indices = _column_indices(reader, ('startDate', 'duration', 'totalEnergyBurned', 'totalDistance'))
+        if indices is None:
+            return aggregated_data
+        date_idx, duration_idx, energy_idx, distance_idx = indices
+        year_month = parse_year_month
+        months = MONTHS
         for row in reader:
             try:
-                start_date_str = row['startDate']
+                start_date_str = row[date_idx]
                 # Robust date parsing
-                date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                year = date_obj.year
-                month = date_obj.strftime('%B')
+                year, month = year_month(start_date_str[:10])
                 
-                aggregated_data[year][month]['count'] += 1
-                aggregated_data[year][month]['duration'] += float(row['duration'])
-                aggregated_data[year][month]['energy'] += float(row['totalEnergyBurned'])
-                aggregated_data[year][month]['distance'] += float(row['totalDistance'])
+                stats = aggregated_data[year][months[month]]
+                stats['count'] += 1
+                stats['duration'] += float(row[duration_idx])
+                stats['energy'] += float(row[energy_idx])
+                stats['distance'] += float(row[distance_idx])
             except (ValueError, IndexError):
                 continue
                 
@@ -399,15 +476,13 @@ def format_aggregated_data(aggregated_data):
     
     for year in sorted_years:
         months_data = aggregated_data[year]
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months = [m for m in MONTHS if m in months_data]
         
-        durations = [months_data[m]['duration'] for m in sorted_months]
-        energies = [months_data[m]['energy'] for m in sorted_months]
-        distances = [months_data[m]['distance'] for m in sorted_months]
-        counts = [months_data[m]['count'] for m in sorted_months]
+        rows = [months_data[m] for m in sorted_months]
+        durations = [r['duration'] for r in rows]
+        energies = [r['energy'] for r in rows]
+        distances = [r['distance'] for r in rows]
+        counts = [r['count'] for r in rows]
         
         result.append({
             'year': year,
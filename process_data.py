@@ -1,10 +1,25 @@
 import lxml.etree as ET
 import csv
+import gzip
+import mmap
 import os
 import json
-from datetime import datetime
+import sys
 from tqdm import tqdm
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+
+from parser import (
+    HEART_RATE_RECORD, MONTHS, RECORD_OUTPUTS, SLEEP_RECORD, STEPS_RECORD,
+    WRITE_BATCH_SIZE, WRITE_BUFFER_SIZE, parse_minutes_between, parse_year_month,
+)
+
+try:
+    import orjson
+except ImportError:
+    # Fallback to the stdlib json module if orjson isn't installed
+    orjson = None
 
 try:
     from config import DATA_DIR
@@ -15,291 +30,201 @@ except ImportError:
 EXPORT_FILE = os.path.join(DATA_DIR, 'export.xml')
 PROCESSED_DIR = os.path.join(DATA_DIR, 'processed_data')
 
-def process_sleep_data():
+# Bytes of export.xml fed to the parser at a time in pass 1
+READ_CHUNK_SIZE = 1 << 20
+
+# The sleep/steps/heart-rate CSVs are only read by the dashboard's date-filtered
+# and daily views; set AHD_CSV=0 to skip them and keep just the aggregates
+WRITE_GRANULAR_CSV = os.environ.get('AHD_CSV', '1') != '0'
+
+# Most Records in an export are other types; one set lookup skips them
+WANTED_RECORDS = frozenset((SLEEP_RECORD, STEPS_RECORD, HEART_RATE_RECORD))
+
+def _iter_export(xml_f, tags, pbar):
     """
-    Process sleep data from export.xml
+    Yields (event, element) for the end of each element in tags, like iterparse.
+    The file is memory-mapped and fed to an XMLPullParser in READ_CHUNK_SIZE
+    chunks, advancing pbar by each chunk's size.
     """
-    print("\nProcessing sleep data...")
-    sleep_dir = os.path.join(PROCESSED_DIR, 'sleep')
-    if not os.path.exists(sleep_dir):
-        os.makedirs(sleep_dir)
-    
-    csv_path = os.path.join(sleep_dir, 'sleep.csv')
-    
-    with open(csv_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['startDate', 'endDate', 'value', 'duration'])
-        
-        try:
-            context = ET.iterparse(EXPORT_FILE, events=('end',), tag='Record')
-            count = 0
-            
-            for event, elem in context:
-                record_type = elem.get('type')
-                if record_type == 'HKCategoryTypeIdentifierSleepAnalysis':
-                    start_date = elem.get('startDate')
-                    end_date = elem.get('endDate')
-                    value = elem.get('value', '0')
-                    
-                    try:
-                        start = datetime.strptime(start_date[:19], '%Y-%m-%d %H:%M:%S')
-                        end = datetime.strptime(end_date[:19], '%Y-%m-%d %H:%M:%S')
-                        duration = (end - start).total_seconds() / 60
-                    except:
-                        duration = 0
-                    
-                    writer.writerow([start_date, end_date, value, duration])
-                    count += 1
-                
-                elem.clear()
-                while elem.getprevious() is not None:
-                    del elem.getparent()[0]
-                    
-            print(f"  Processed {count} sleep records")
-                    
-        except Exception as e:
-            print(f"Error parsing sleep data: {e}")
-    
-    # Aggregate sleep data
-    aggregated_data = defaultdict(lambda: defaultdict(lambda: {
-        'total_sleep_minutes': 0.0,
-        'in_bed_minutes': 0.0,
-        'awake_minutes': 0.0
-    }))
-    
-    with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                start_date_str = row['startDate']
-                date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                year = date_obj.year
-                month = date_obj.strftime('%B')
-                
-                duration = float(row['duration'])
-                value = row['value']
-                
-                if 'Asleep' in value:
-                    aggregated_data[year][month]['total_sleep_minutes'] += duration
-                elif 'InBed' in value:
-                    aggregated_data[year][month]['in_bed_minutes'] += duration
-                elif 'Awake' in value:
-                    aggregated_data[year][month]['awake_minutes'] += duration
-                    
-            except (ValueError, KeyError):
-                continue
-    
-    # Format for Chart.js
-    formatted_result = []
+    parser = ET.XMLPullParser(events=('end',), tag=tags)
+    with mmap.mmap(xml_f.fileno(), 0, access=mmap.ACCESS_READ) as xml_map:
+        for chunk in iter(lambda: xml_map.read(READ_CHUNK_SIZE), b''):
+            parser.feed(chunk)
+            yield from parser.read_events()
+            pbar.update(len(chunk))
+    parser.close()
+    yield from parser.read_events()
+
+def _month_rows(months_data):
+    """(month names, buckets) for the slots of a 12-month year that saw any records"""
+    present = [i for i, bucket in enumerate(months_data) if bucket[0]]
+    return [MONTHS[i] for i in present], [months_data[i] for i in present]
+
+def _encode_json(obj):
+    """Compact JSON bytes for obj, using orjson when available"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def dump_json_gz(path, items):
+    """
+    Write items as a gzipped JSON array, encoding one item at a time so the
+    whole array is never built in memory
+    """
+    with gzip.open(path, 'wb') as f:
+        f.write(b'[')
+        for i, item in enumerate(items):
+            if i:
+                f.write(b',')
+            f.write(_encode_json(item))
+        f.write(b']')
+
+def _row_values(headers):
+    """
+    Build a function returning a record's values in header order, '' when missing.
+    Generated once per activity so each row is a run of plain gets rather than
+    DictWriter's per-row loop over the fieldnames and check for extra keys.
+    """
+    src = "def row_values(record):\n    get = record.get\n    return ("
+    src += "".join(f"get({key!r}, ''), " for key in headers) + ")\n"
+    namespace = {}
+    exec(src, namespace)
+    return namespace['row_values']
+
+def _sleep_years(aggregated_data):
+    """Chart.js datasets for each year of sleep totals"""
     sorted_years = sorted(aggregated_data.keys())
     
     for year in sorted_years:
-        months_data = aggregated_data[year]
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        sorted_months = [m for m in month_order if m in months_data]
-        
-        sleep_hours = [months_data[m]['total_sleep_minutes'] / 60 for m in sorted_months]
-        in_bed_hours = [months_data[m]['in_bed_minutes'] / 60 for m in sorted_months]
+        sorted_months, rows = _month_rows(aggregated_data[year])
+        sleep_hours = [r[1] / 60 for r in rows]
+        in_bed_hours = [r[2] / 60 for r in rows]
         
-        formatted_result.append({
+        yield {
             'year': year,
             'labels': sorted_months,
             'datasets': {
                 'sleep_hours': sleep_hours,
                 'in_bed_hours': in_bed_hours
             }
-        })
-    
-    json_path = os.path.join(sleep_dir, 'aggregated.json')
-    with open(json_path, 'w') as f:
-        json.dump(formatted_result, f)
+        }
 
-def process_steps_data():
+def process_sleep_data(aggregated_data):
     """
-    Process step count data from export.xml
+    Formats the sleep totals gathered during the export pass and writes aggregated.json.gz
     """
-    print("\nProcessing steps data...")
-    steps_dir = os.path.join(PROCESSED_DIR, 'steps')
-    if not os.path.exists(steps_dir):
-        os.makedirs(steps_dir)
+    print("\nProcessing sleep data...")
+    sleep_dir = os.path.join(PROCESSED_DIR, 'sleep')
     
-    csv_path = os.path.join(steps_dir, 'steps.csv')
+    json_path = os.path.join(sleep_dir, 'aggregated.json.gz')
+    dump_json_gz(json_path, _sleep_years(aggregated_data))
+
+def _steps_years(aggregated_data):
+    """Chart.js datasets for each year of step totals"""
+    sorted_years = sorted(aggregated_data.keys())
     
-    with open(csv_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['startDate', 'endDate', 'value'])
+    for year in sorted_years:
+        sorted_months, rows = _month_rows(aggregated_data[year])
+        total_steps = [r[1] for r in rows]
         
-        try:
-            context = ET.iterparse(EXPORT_FILE, events=('end',), tag='Record')
-            count = 0
-            
-            for event, elem in context:
-                record_type = elem.get('type')
-                if record_type == 'HKQuantityTypeIdentifierStepCount':
-                    start_date = elem.get('startDate')
-                    end_date = elem.get('endDate')
-                    value = elem.get('value', '0')
-                    
-                    writer.writerow([start_date, end_date, value])
-                    count += 1
-                
-                elem.clear()
-                while elem.getprevious() is not None:
-                    del elem.getparent()[0]
-                    
-            print(f"  Processed {count} step records")
-                    
-        except Exception as e:
-            print(f"Error parsing steps data: {e}")
-    
-    # Aggregate steps data
-    aggregated_data = defaultdict(lambda: defaultdict(lambda: {
-        'total_steps': 0,
-        'count': 0
-    }))
-    
-    with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                start_date_str = row['startDate']
-                date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                year = date_obj.year
-                month = date_obj.strftime('%B')
-                
-                steps = int(float(row['value']))
-                aggregated_data[year][month]['total_steps'] += steps
-                aggregated_data[year][month]['count'] += 1
-                
-            except (ValueError, KeyError):
-                continue
+        yield {
+            'year': year,
+            'labels': sorted_months,
+            'datasets': {
+                'total_steps': total_steps
+            }
+        }
+
+def process_steps_data(aggregated_data):
+    """
+    Formats the step totals gathered during the export pass and writes aggregated.json.gz
+    """
+    print("\nProcessing steps data...")
+    steps_dir = os.path.join(PROCESSED_DIR, 'steps')
     
-    # Format for Chart.js
-    formatted_result = []
+    json_path = os.path.join(steps_dir, 'aggregated.json.gz')
+    dump_json_gz(json_path, _steps_years(aggregated_data))
+
+def _heart_rate_years(aggregated_data):
+    """Chart.js datasets for each year of heart rate stats"""
     sorted_years = sorted(aggregated_data.keys())
     
     for year in sorted_years:
-        months_data = aggregated_data[year]
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months, rows = _month_rows(aggregated_data[year])
+        avg_hr = [r[1] / r[0] for r in rows]
+        min_hr = [r[2] for r in rows]
+        max_hr = [r[3] for r in rows]
         
-        total_steps = [months_data[m]['total_steps'] for m in sorted_months]
-        
-        formatted_result.append({
+        yield {
             'year': year,
             'labels': sorted_months,
             'datasets': {
-                'total_steps': total_steps
+                'avg_heart_rate': avg_hr,
+                'min_heart_rate': min_hr,
+                'max_heart_rate': max_hr
             }
-        })
-    
-    json_path = os.path.join(steps_dir, 'aggregated.json')
-    with open(json_path, 'w') as f:
-        json.dump(formatted_result, f)
+        }
 
-def process_heart_rate_data():
+def process_heart_rate_data(aggregated_data):
     """
-    Process heart rate data from export.xml
+    Formats the heart rate stats gathered during the export pass and writes aggregated.json.gz
     """
     print("\nProcessing heart rate data...")
     hr_dir = os.path.join(PROCESSED_DIR, 'heart_rate')
-    if not os.path.exists(hr_dir):
-        os.makedirs(hr_dir)
-    
-    csv_path = os.path.join(hr_dir, 'heart_rate.csv')
-    
-    with open(csv_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['startDate', 'value'])
-        
-        try:
-            context = ET.iterparse(EXPORT_FILE, events=('end',), tag='Record')
-            count = 0
-            
-            for event, elem in context:
-                record_type = elem.get('type')
-                if record_type == 'HKQuantityTypeIdentifierHeartRate':
-                    start_date = elem.get('startDate')
-                    value = elem.get('value', '0')
-                    
-                    writer.writerow([start_date, value])
-                    count += 1
-                
-                elem.clear()
-                while elem.getprevious() is not None:
-                    del elem.getparent()[0]
-                    
-            print(f"  Processed {count} heart rate records")
-                    
-        except Exception as e:
-            print(f"Error parsing heart rate data: {e}")
     
-    # Aggregate heart rate data
-    aggregated_data = defaultdict(lambda: defaultdict(lambda: {
-        'sum': 0.0,
-        'count': 0,
-        'min': float('inf'),
-        'max': 0.0
-    }))
-    
-    with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                start_date_str = row['startDate']
-                date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                year = date_obj.year
-                month = date_obj.strftime('%B')
-                
-                hr = float(row['value'])
-                aggregated_data[year][month]['sum'] += hr
-                aggregated_data[year][month]['count'] += 1
-                aggregated_data[year][month]['min'] = min(aggregated_data[year][month]['min'], hr)
-                aggregated_data[year][month]['max'] = max(aggregated_data[year][month]['max'], hr)
-                
-            except (ValueError, KeyError):
-                continue
-    
-    # Format for Chart.js
-    formatted_result = []
+    json_path = os.path.join(hr_dir, 'aggregated.json.gz')
+    dump_json_gz(json_path, _heart_rate_years(aggregated_data))
+
+def _workout_years(aggregated_data):
+    """Chart.js datasets for each year of an activity's workout totals"""
     sorted_years = sorted(aggregated_data.keys())
     
     for year in sorted_years:
-        months_data = aggregated_data[year]
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        sorted_months = [m for m in month_order if m in months_data]
+        sorted_months, rows = _month_rows(aggregated_data[year])
+        counts = [r[0] for r in rows]
+        durations = [r[1] for r in rows]
+        energies = [r[2] for r in rows]
+        distances = [r[3] for r in rows]
         
-        avg_hr = [months_data[m]['sum'] / months_data[m]['count'] if months_data[m]['count'] > 0 else 0 
-                  for m in sorted_months]
-        min_hr = [months_data[m]['min'] if months_data[m]['min'] != float('inf') else 0 
-                  for m in sorted_months]
-        max_hr = [months_data[m]['max'] for m in sorted_months]
-        
-        formatted_result.append({
+        yield {
             'year': year,
             'labels': sorted_months,
             'datasets': {
-                'avg_heart_rate': avg_hr,
-                'min_heart_rate': min_hr,
-                'max_heart_rate': max_hr
+                'duration': durations,
+                'energy': energies,
+                'distance': distances,
+                'count': counts
             }
-        })
+        }
+
+def process_activity(activity_dir, all_keys, records, aggregated_data):
+    """
+    Writes one activity's workouts.csv and aggregated.json.gz from the records and
+    month buckets gathered in pass 1. Runs in a worker process, so it only uses
+    its arguments.
+    """
+    # Sort keys: standard ones first, then others alphabetically
+    standard_keys = ['startDate', 'endDate', 'duration', 'totalEnergyBurned', 'totalDistance', 'sourceName']
+    other_keys = sorted([k for k in all_keys if k not in standard_keys])
+    final_headers = [k for k in standard_keys if k in all_keys] + other_keys
+    
+    with open(os.path.join(activity_dir, 'workouts.csv'), 'w', newline='', buffering=WRITE_BUFFER_SIZE) as out_f:
+        # csv.writer still does the quoting, since workout values can contain commas
+        writer = csv.writer(out_f)
+        writer.writerow(final_headers)
+        writer.writerows(map(_row_values(final_headers), records))
     
-    json_path = os.path.join(hr_dir, 'aggregated.json')
-    with open(json_path, 'w') as f:
-        json.dump(formatted_result, f)
+    # Format for Chart.js immediately to save app processing time
+    dump_json_gz(os.path.join(activity_dir, 'aggregated.json.gz'), _workout_years(aggregated_data))
 
 def process_data():
     """
     Parses the Apple Health export XML file using lxml.
     Extracts ALL attributes, MetadataEntry, and WorkoutStatistics.
-    Uses a 2-pass approach: XML -> JSONL -> CSV to handle dynamic schemas.
+    Uses a 2-pass approach to handle dynamic schemas: workouts are collected per
+    activity in memory, then written to CSV once all of an activity's columns are known.
+    The sleep, steps and heart rate records are aggregated, and written to CSV
+    unless WRITE_GRANULAR_CSV is off, during the same XML walk.
     """
     if not os.path.exists(EXPORT_FILE):
         print(f"Error: {EXPORT_FILE} not found.")
@@ -311,184 +236,230 @@ def process_data():
     file_size = os.path.getsize(EXPORT_FILE)
     print(f"Processing {EXPORT_FILE} ({file_size / (1024*1024*1024):.2f} GB)...")
     
-    # Pass 1: XML -> JSONL
-    print("Pass 1: Extracting workout data to JSONL...")
-    jsonl_files = {} # activity_type -> file_handle
+    # Pass 1: XML -> per-activity records, plus the sleep/steps/heart-rate CSVs
+    print("Pass 1: Extracting workout and health records...")
+    activity_records = {} # activity_type -> list of record dicts
+    activity_keys = {} # activity_type -> every key seen in those records
+    activity_aggregates = {} # activity_type -> year -> 12 x [count, duration, energy, distance]
+    
+    sleep_dir = os.path.join(PROCESSED_DIR, 'sleep')
+    steps_dir = os.path.join(PROCESSED_DIR, 'steps')
+    hr_dir = os.path.join(PROCESSED_DIR, 'heart_rate')
+    for d in (sleep_dir, steps_dir, hr_dir):
+        os.makedirs(d, exist_ok=True)
     
-    try:
-        context = ET.iterparse(EXPORT_FILE, events=('end',), tag='Workout')
+    sleep_batch, steps_batch, hr_batch = [], [], []
+    sleep_count = steps_count = hr_count = 0
+    
+    # year -> 12 month buckets for the health records, filled in during pass 1.
+    # Slot 0 of every bucket is its record count; a month with 0 is left out.
+    sleep_aggregates = defaultdict(lambda: [[0, 0.0, 0.0, 0.0] for _ in range(12)]) # count, asleep, in bed, awake minutes
+    steps_aggregates = defaultdict(lambda: [[0, 0] for _ in range(12)]) # count, steps
+    hr_aggregates = defaultdict(lambda: [[0, 0.0, 0.0, 0.0] for _ in range(12)]) # count, sum, min, max
+    
+    write_csv = WRITE_GRANULAR_CSV
+    sleep_csv = os.path.join(sleep_dir, 'sleep.csv')
+    steps_csv = os.path.join(steps_dir, 'steps.csv')
+    hr_csv = os.path.join(hr_dir, 'heart_rate.csv')
+    
+    # One walk over export.xml; Record and Workout are the only elements materialized
+    with open(EXPORT_FILE, 'rb') as xml_f, ExitStack() as csv_files, \
+            tqdm(total=file_size, unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+        if write_csv:
+            sleep_f = csv_files.enter_context(open(sleep_csv, 'w', newline='', buffering=WRITE_BUFFER_SIZE))
+            steps_f = csv_files.enter_context(open(steps_csv, 'w', newline='', buffering=WRITE_BUFFER_SIZE))
+            hr_f = csv_files.enter_context(open(hr_csv, 'w', newline='', buffering=WRITE_BUFFER_SIZE))
+            
+            # Same unquoted line format as parser.parse_records
+            for record_type, f in ((SLEEP_RECORD, sleep_f), (STEPS_RECORD, steps_f), (HEART_RATE_RECORD, hr_f)):
+                f.write(','.join(RECORD_OUTPUTS[record_type][1]) + '\r\n')
+        else:
+            # Drop CSVs left by an earlier run so the app doesn't filter stale records
+            for path in (sleep_csv, steps_csv, hr_csv):
+                if os.path.exists(path):
+                    os.remove(path)
         
-        with tqdm(total=file_size, unit='B', unit_scale=True, unit_divisor=1024) as pbar:
-            count = 0
+        try:
+            context = _iter_export(xml_f, ('Record', 'Workout'), pbar)
+            intern = sys.intern
+            year_month = parse_year_month
+            minutes_between = parse_minutes_between
             for event, elem in context:
-                activity_type = elem.get('workoutActivityType')
-                if activity_type:
-                    if activity_type.startswith('HKWorkoutActivityType'):
-                        activity_type = activity_type[len('HKWorkoutActivityType'):]
-                    
-                    activity_dir = os.path.join(PROCESSED_DIR, activity_type)
-                    if not os.path.exists(activity_dir):
-                        os.makedirs(activity_dir)
-                    
-                    jsonl_path = os.path.join(activity_dir, 'workouts.jsonl')
-                    
-                    if activity_type not in jsonl_files:
-                        jsonl_files[activity_type] = open(jsonl_path, 'w')
+                if elem.tag == 'Record':
+                    # Bound once; a wanted record reads several attributes through it
+                    get = elem.get
+                    record_type = get('type')
+                    if record_type in WANTED_RECORDS:
+                        if record_type == HEART_RATE_RECORD:
+                            start_date = get('startDate', '')
+                            value = get('value', '0')
+                            hr_count += 1
+                            if write_csv:
+                                hr_batch.append(f"{start_date},{value}\r\n")
+                                if len(hr_batch) >= WRITE_BATCH_SIZE:
+                                    hr_f.write(''.join(hr_batch))
+                                    hr_batch.clear()
+
+                            try:
+                                year, month = year_month(start_date[:10])
+                                hr = float(value)
+                                bucket = hr_aggregates[year][month]
+                                if bucket[0]:
+                                    if hr < bucket[2]:
+                                        bucket[2] = hr
+                                    elif hr > bucket[3]:
+                                        bucket[3] = hr
+                                else:
+                                    # First reading of the month seeds both min and max
+                                    bucket[2] = bucket[3] = hr
+                                bucket[0] += 1
+                                bucket[1] += hr
+                            except ValueError:
+                                pass
+                        elif record_type == STEPS_RECORD:
+                            start_date = get('startDate', '')
+                            value = get('value', '0')
+                            steps_count += 1
+                            if write_csv:
+                                steps_batch.append(f"{start_date},{get('endDate', '')},{value}\r\n")
+                                if len(steps_batch) >= WRITE_BATCH_SIZE:
+                                    steps_f.write(''.join(steps_batch))
+                                    steps_batch.clear()
+
+                            try:
+                                year, month = year_month(start_date[:10])
+                                steps = int(float(value))
+                                bucket = steps_aggregates[year][month]
+                                bucket[0] += 1
+                                bucket[1] += steps
+                            except ValueError:
+                                pass
+                        elif record_type == SLEEP_RECORD:
+                            start_date = get('startDate', '')
+                            end_date = get('endDate', '')
+                            try:
+                                duration = minutes_between(start_date, end_date)
+                            except:
+                                duration = 0
+
+                            value = get('value', '0')
+                            sleep_count += 1
+                            if write_csv:
+                                sleep_batch.append(f"{start_date},{end_date},{value},{duration}\r\n")
+                                if len(sleep_batch) >= WRITE_BATCH_SIZE:
+                                    sleep_f.write(''.join(sleep_batch))
+                                    sleep_batch.clear()
+
+                            try:
+                                year, month = year_month(start_date[:10])
+                                if 'Asleep' in value:
+                                    slot = 1
+                                elif 'InBed' in value:
+                                    slot = 2
+                                elif 'Awake' in value:
+                                    slot = 3
+                                else:
+                                    slot = 0
+                                if slot:
+                                    bucket = sleep_aggregates[year][month]
+                                    bucket[0] += 1
+                                    bucket[slot] += duration
+                            except ValueError:
+                                pass
+                else:
+                    # Copy the attributes out of lxml once; everything below reads the dict.
+                    # Keys are interned so every workout shares one copy of each column
+                    # name, which also lets pickle send each name once to the pass-2 workers.
+                    record = {intern(k): v for k, v in elem.attrib.items()}
+                    activity_type = record.get('workoutActivityType')
+                    if activity_type:
+                        if activity_type.startswith('HKWorkoutActivityType'):
+                            activity_type = activity_type[len('HKWorkoutActivityType'):]
                     
-                    # Extract all attributes
-                    record = dict(elem.attrib)
+                        # First workout of this type: set up its directory and accumulators
+                        if activity_type not in activity_records:
+                            os.makedirs(os.path.join(PROCESSED_DIR, activity_type), exist_ok=True)
+                            activity_records[activity_type] = []
+                            activity_keys[activity_type] = set()
+                            activity_aggregates[activity_type] = defaultdict(lambda: [[0, 0.0, 0.0, 0.0] for _ in range(12)])
                     
-                    # Extract children (Metadata, Statistics)
-                    for child in elem:
-                        if child.tag == 'MetadataEntry':
-                            key = child.get('key')
-                            val = child.get('value')
-                            if key:
-                                record[f"meta_{key}"] = val
-                        elif child.tag == 'WorkoutStatistics':
-                            stat_type = child.get('type')
-                            if stat_type:
-                                # Shorten stat type if possible
-                                if stat_type.startswith('HKQuantityTypeIdentifier'):
-                                    stat_type = stat_type[len('HKQuantityTypeIdentifier'):]
+                        # Extract children (Metadata, Statistics)
+                        for child in elem:
+                            tag = child.tag
+                            if tag == 'MetadataEntry':
+                                key = child.get('key')
+                                if key:
+                                    record[intern(f"meta_{key}")] = child.get('value')
+                            elif tag == 'WorkoutStatistics':
+                                attrib = child.attrib
+                                stat_type = attrib.get('type')
+                                if stat_type:
+                                    # Shorten stat type if possible
+                                    if stat_type.startswith('HKQuantityTypeIdentifier'):
+                                        stat_type = stat_type[len('HKQuantityTypeIdentifier'):]
                                 
-                                for k, v in child.attrib.items():
-                                    if k != 'type':
-                                        record[f"stat_{stat_type}_{k}"] = v
+                                    prefix = f"stat_{stat_type}_"
+                                    record.update({intern(prefix + k): v for k, v in attrib.items() if k != 'type'})
                     
-                    # Write to JSONL
-                    jsonl_files[activity_type].write(json.dumps(record) + '\n')
-                    count += 1
+                        activity_records[activity_type].append(record)
+                        activity_keys[activity_type].update(record)
                     
-                    if count % 1000 == 0:
-                        pbar.update(0) # Keep pbar alive
+                        # Pre-aggregate for the dashboard while the record is at hand.
+                        # A missing startDate fails parse_year_month like any other bad date.
+                        get = record.get
+                        aggregated_data = activity_aggregates[activity_type]
+                        try:
+                            # Expected format: YYYY-MM-DD HH:MM:SS ...
+                            year, month = year_month(get('startDate', '')[:10])
+                            
+                            bucket = aggregated_data[year][month]
+                            bucket[0] += 1
+                            bucket[1] += float(get('duration') or 0)
+                            
+                            # Energy: try stat_ActiveEnergyBurned_sum first, fallback to totalEnergyBurned
+                            bucket[2] += float(get('stat_ActiveEnergyBurned_sum') or get('totalEnergyBurned') or 0)
+                            
+                            # Distance: try stat_DistanceWalkingRunning_sum first, fallback to totalDistance
+                            bucket[3] += float(get('stat_DistanceWalkingRunning_sum') or get('totalDistance') or 0)
+                        except ValueError:
+                            pass
 
-                elem.clear()
+                elem.clear(keep_tail=True)
+                parent = elem.getparent()
                 while elem.getprevious() is not None:
-                    del elem.getparent()[0]
+                    del parent[0]
                     
-    except Exception as e:
-        print(f"\nError parsing XML: {e}")
-    finally:
-        for f in jsonl_files.values():
-            f.close()
-            
-    # Pass 2: JSONL -> CSV
-    print("\nPass 2: Converting JSONL to CSV (flattening schema)...")
-    
-    activity_dirs = [d for d in os.listdir(PROCESSED_DIR) if os.path.isdir(os.path.join(PROCESSED_DIR, d))]
+        except Exception as e:
+            print(f"\nError parsing XML: {e}")
+        finally:
+            if write_csv:
+                sleep_f.write(''.join(sleep_batch))
+                steps_f.write(''.join(steps_batch))
+                hr_f.write(''.join(hr_batch))
     
-    for activity in tqdm(activity_dirs, desc="Activities"):
-        jsonl_path = os.path.join(PROCESSED_DIR, activity, 'workouts.jsonl')
-        csv_path = os.path.join(PROCESSED_DIR, activity, 'workouts.csv')
-        
-        if not os.path.exists(jsonl_path):
-            continue
+    print(f"  Processed {sleep_count} sleep, {steps_count} step and {hr_count} heart rate records")
             
-        # Scan for all possible keys
-        all_keys = set()
-        with open(jsonl_path, 'r') as f:
-            for line in f:
-                try:
-                    record = json.loads(line)
-                    all_keys.update(record.keys())
-                except:
-                    pass
-        
-        # Sort keys: standard ones first, then others alphabetically
-        standard_keys = ['startDate', 'endDate', 'duration', 'totalEnergyBurned', 'totalDistance', 'sourceName']
-        other_keys = sorted([k for k in all_keys if k not in standard_keys])
-        final_headers = [k for k in standard_keys if k in all_keys] + other_keys
-        
-        # Write CSV
-        with open(csv_path, 'w', newline='') as out_f:
-            writer = csv.DictWriter(out_f, fieldnames=final_headers)
-            writer.writeheader()
-            
-            with open(jsonl_path, 'r') as in_f:
-                for line in in_f:
-                    try:
-                        record = json.loads(line)
-                        writer.writerow(record)
-                    except:
-                        pass
-        
-        # Clean up JSONL
-        os.remove(jsonl_path)
-
-        # ---------------------------------------------------------
-        # Step 3: Pre-aggregate data for the dashboard
-        # ---------------------------------------------------------
-        print(f"  Aggregating {activity}...")
-        aggregated_data = defaultdict(lambda: defaultdict(lambda: {
-            'count': 0,
-            'duration': 0.0,
-            'energy': 0.0,
-            'distance': 0.0
-        }))
-
-        with open(csv_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                try:
-                    start_date_str = row.get('startDate', '')
-                    if not start_date_str: continue
-                    
-                    # Robust date parsing
-                    # Expected format: YYYY-MM-DD HH:MM:SS ...
-                    date_obj = datetime.strptime(start_date_str[:10], '%Y-%m-%d')
-                    year = date_obj.year
-                    month = date_obj.strftime('%B')
-                    
-                    aggregated_data[year][month]['count'] += 1
-                    aggregated_data[year][month]['duration'] += float(row.get('duration', 0) or 0)
-                    
-                    # Energy: try stat_ActiveEnergyBurned_sum first, fallback to totalEnergyBurned
-                    energy = row.get('stat_ActiveEnergyBurned_sum') or row.get('totalEnergyBurned', 0) or 0
-                    aggregated_data[year][month]['energy'] += float(energy)
-                    
-                    # Distance: try stat_DistanceWalkingRunning_sum first, fallback to totalDistance
-                    distance = row.get('stat_DistanceWalkingRunning_sum') or row.get('totalDistance', 0) or 0
-                    aggregated_data[year][month]['distance'] += float(distance)
-                except (ValueError, IndexError):
-                    continue
-        
-        # Format for Chart.js immediately to save app processing time
-        formatted_result = []
-        sorted_years = sorted(aggregated_data.keys())
+    # Pass 2: records -> CSV
+    print("\nPass 2: Writing CSVs (flattening schema)...")
+    
+    # Activities are independent, so each one is written out in a worker process.
+    # The month buckets are passed as a plain dict; the defaultdict's lambda can't be pickled.
+    futures = []
+    with ProcessPoolExecutor(max_workers=max(1, min(os.cpu_count() or 1, len(activity_records)))) as executor:
+        for activity, records in activity_records.items():
+            futures.append(executor.submit(
+                process_activity,
+                os.path.join(PROCESSED_DIR, activity), activity_keys[activity], records,
+                dict(activity_aggregates[activity])
+            ))
         
-        for year in sorted_years:
-            months_data = aggregated_data[year]
-            month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                        'July', 'August', 'September', 'October', 'November', 'December']
-            
-            sorted_months = [m for m in month_order if m in months_data]
-            
-            durations = [months_data[m]['duration'] for m in sorted_months]
-            energies = [months_data[m]['energy'] for m in sorted_months]
-            distances = [months_data[m]['distance'] for m in sorted_months]
-            counts = [months_data[m]['count'] for m in sorted_months]
-            
-            formatted_result.append({
-                'year': year,
-                'labels': sorted_months,
-                'datasets': {
-                    'duration': durations,
-                    'energy': energies,
-                    'distance': distances,
-                    'count': counts
-                }
-            })
-
-        # Save to JSON
-        json_path = os.path.join(PROCESSED_DIR, activity, 'aggregated.json')
-        with open(json_path, 'w') as f:
-            json.dump(formatted_result, f)
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Activities"):
+            future.result()
 
-    # Process additional health data types
-    process_sleep_data()
-    process_steps_data()
-    process_heart_rate_data()
+    # Write the health data aggregates gathered in pass 1
+    process_sleep_data(sleep_aggregates)
+    process_steps_data(steps_aggregates)
+    process_heart_rate_data(hr_aggregates)
 
     print("\nDone! Granular CSVs and Aggregated JSONs generated.")
 
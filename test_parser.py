@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import parser
+
+
+class AggregateDatesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_csv(self, text):
+        path = os.path.join(self.tmp_dir, 'records.csv')
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_impossible_calendar_dates_are_skipped(self):
+        csv_path = self.write_csv(
+            'startDate,value\n'
+            '2023-02-28 08:00:00 -0800,100\n'
+            '2023-02-30 08:00:00 -0800,200\n'
+            '2023-04-31 08:00:00 -0800,400\n'
+            '2024-02-29 08:00:00 -0800,800\n'
+        )
+
+        steps = parser.aggregate_steps_data(csv_path)
+
+        self.assertEqual(sorted(steps), [2023, 2024])
+        self.assertEqual(dict(steps[2023]), {'February': {'total_steps': 100, 'count': 1}})
+        self.assertEqual(dict(steps[2024]), {'February': {'total_steps': 800, 'count': 1}})
+
+
+if __name__ == '__main__':
+    unittest.main()